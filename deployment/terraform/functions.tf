@@ -56,6 +56,7 @@ resource "google_cloudfunctions_function" "pdf_ingestion" {
   environment_variables = {
     GCP_PROJECT                   = var.project_id
     LOCATION                      = var.region
+    PROCESSING_BUCKET             = google_storage_bucket.processing_bucket.name
     TEXT_EMBEDDING_MODEL          = "textembedding-gecko@003"
     MULTIMODAL_MODEL              = "multimodalembedding@latest"
     VECTOR_SEARCH_ENDPOINT_ID     = google_vertex_ai_index_endpoint.text_endpoint.id
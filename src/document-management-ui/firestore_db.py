@@ -1,6 +1,9 @@
+import os
 import sys
 import logging
 import json
+import time
+from functools import lru_cache
 import numpy as np
 from typing import List, Dict, Any, Optional, Tuple
 from langchain.schema import Document, BaseRetriever
@@ -18,37 +21,120 @@ except ImportError:
     logging.warning("Google Cloud Firestore not available. Install google-cloud-firestore to use Firestore storage.")
 
 
+def quantize_embedding(embedding: List[float]) -> Tuple[bytes, float]:
+    """Quantize an embedding to int8 bytes plus a per-vector scale factor"""
+    vector = np.asarray(embedding, dtype=np.float32)
+    scale = float(np.max(np.abs(vector))) / 127 or 1.0
+    return np.round(vector / scale).astype(np.int8).tobytes(), scale
+
+
+def dequantize_embedding(data: bytes, scale: float) -> np.ndarray:
+    """Restore a float32 embedding from int8 bytes and its scale factor"""
+    return np.frombuffer(data, dtype=np.int8).astype(np.float32) * scale
+
+
+def stored_embedding(doc_data: Dict[str, Any]) -> Optional[np.ndarray]:
+    """Return a document's embedding, or None if it has none"""
+    if doc_data.get("embedding_i8"):
+        return dequantize_embedding(doc_data["embedding_i8"], doc_data.get("embedding_scale", 1.0))
+
+    # Documents saved before quantization store a plain array
+    if doc_data.get("embedding"):
+        return np.asarray(doc_data["embedding"], dtype=np.float32)
+
+    return None
+
+
+def top_k_indices(scores: np.ndarray, k: int) -> np.ndarray:
+    """Return indices of the k highest scores, best first"""
+    if k <= 0:
+        return np.empty(0, dtype=np.intp)
+
+    # Full sort only when every score is returned anyway
+    if k >= len(scores):
+        return np.argsort(-scores, kind="stable")
+
+    # Partition out the top k in O(N), then sort just those
+    top = np.argpartition(-scores, k - 1)[:k]
+    return top[np.argsort(-scores[top], kind="stable")]
+
+
+def normalize_rows(matrix: np.ndarray) -> np.ndarray:
+    """Scale each row of matrix to unit length, leaving zero rows as zeros"""
+    if matrix.size == 0:
+        return matrix
+
+    norms = np.linalg.norm(matrix, axis=1, keepdims=True)
+    return np.divide(matrix, norms, out=np.zeros_like(matrix), where=norms != 0)
+
+
+def cosine_similarities(query: List[float], matrix: np.ndarray) -> np.ndarray:
+    """Calculate cosine similarity between a query vector and each row of matrix
+
+    Rows of the cached matrix are already unit length, so only the query
+    needs normalizing and scoring is a single matrix-vector product.
+    """
+    query_np = np.asarray(query, dtype=np.float32)
+    query_norm = np.linalg.norm(query_np)
+
+    # A zero query scores 0.0 everywhere instead of dividing by zero
+    if query_norm == 0:
+        return np.zeros(len(matrix), dtype=np.float32)
+
+    return matrix @ (query_np / query_norm)
+
+
 class FirestoreVectorStore:
     """Firestore-based vector store for similarity search"""
     
     def __init__(self, firestore_loader: 'FirestoreDataLoader', embeddings: Embeddings):
         self.firestore_loader = firestore_loader
         self.embeddings = embeddings
+        # Repeated questions reuse their query embedding instead of re-embedding
+        self._embed_query = lru_cache(maxsize=1024)(embeddings.embed_query)
         self.collection_name = firestore_loader.collection_name + "_vectors"
         self.vector_collection = firestore_loader.db.collection(self.collection_name)
+        # In-process copy of the collection's embeddings, see _get_index.
+        # Writes made through another store instance show up after at most
+        # this many seconds.
+        self.cache_ttl = float(get_env_var("VECTOR_CACHE_TTL_SECONDS", "300"))
+        self._index = None
+        self._index_loaded_at = 0.0
     
     def add_documents(self, documents: List[Document]) -> None:
         """Add documents with their embeddings to Firestore"""
-        from google.cloud import firestore
         try:
             batch = self.firestore_loader.db.batch()
             
-            # Generate embeddings for all documents
+            # Generate embeddings for all documents, embedding repeated
+            # chunks (shared headers, boilerplate) only once
             texts = [doc.page_content for doc in documents]
-            embeddings_list = self.embeddings.embed_documents(texts)
+            unique_texts = list(dict.fromkeys(texts))
+            unique_embeddings = dict(zip(unique_texts, self.embeddings.embed_documents(unique_texts)))
+            embeddings_list = [unique_embeddings[text] for text in texts]
             
             for i, (doc, embedding) in enumerate(zip(documents, embeddings_list)):
                 doc_ref = self.vector_collection.document(f"doc_{i}_{hash(doc.page_content)}")
+                # Store as int8 bytes, about 8x smaller than an array of doubles
+                embedding_i8, embedding_scale = quantize_embedding(embedding)
                 doc_data = {
                     "content": doc.page_content,
                     "metadata": doc.metadata,
-                    "embedding": embedding,  # Store as array
+                    "embedding_i8": embedding_i8,
+                    "embedding_scale": embedding_scale,
                     "doc_id": f"doc_{i}",
                     "timestamp": firestore.SERVER_TIMESTAMP
                 }
                 batch.set(doc_ref, doc_data)
+                
+                # Firestore batch has a limit of 500 operations
+                if (i + 1) % 500 == 0:
+                    batch.commit()
+                    batch = self.firestore_loader.db.batch()
             
-            batch.commit()
+            if len(documents) % 500 != 0:
+                batch.commit()
+            self._index = None
             logging.info(f"Saved {len(documents)} documents with embeddings to Firestore collection: {self.collection_name}")
         except Exception as e:
             logging.error(f"Failed to save documents with embeddings to Firestore: {str(e)}")
@@ -56,98 +142,77 @@ class FirestoreVectorStore:
     
     def similarity_search(self, query: str, k: int = 4) -> List[Document]:
         """Perform similarity search using cosine similarity"""
-        try:
-            # Get query embedding
-            query_embedding = self.embeddings.embed_query(query)
-            
-            # Get all documents with embeddings
-            docs = []
-            similarities = []
-            
-            for doc in self.vector_collection.stream():
-                doc_data = doc.to_dict()
-                stored_embedding = doc_data.get("embedding", [])
-                
-                if stored_embedding:
-                    # Calculate cosine similarity
-                    similarity = self._cosine_similarity(query_embedding, stored_embedding)
-                    similarities.append(similarity)
-                    
-                    document = Document(
-                        page_content=doc_data.get("content", ""),
-                        metadata=doc_data.get("metadata", {})
-                    )
-                    docs.append(document)
-            
-            # Sort by similarity and return top k
-            if docs:
-                doc_similarities = list(zip(docs, similarities))
-                doc_similarities.sort(key=lambda x: x[1], reverse=True)
-                return [doc for doc, _ in doc_similarities[:k]]
-            
-            return []
-        except Exception as e:
-            logging.error(f"Failed to perform similarity search: {str(e)}")
-            return []
+        return [doc for doc, _ in self.similarity_search_with_score(query, k=k)]
     
     def similarity_search_with_score(self, query: str, k: int = 4) -> List[Tuple[Document, float]]:
         """Perform similarity search and return documents with similarity scores"""
         try:
             # Get query embedding
-            query_embedding = self.embeddings.embed_query(query)
+            query_embedding = self._embed_query(query)
             
             # Get all documents with embeddings
-            docs = []
-            similarities = []
+            embedding_matrix, docs_data = self._get_index()
             
-            for doc in self.vector_collection.stream():
-                doc_data = doc.to_dict()
-                stored_embedding = doc_data.get("embedding", [])
-                
-                if stored_embedding:
-                    # Calculate cosine similarity
-                    similarity = self._cosine_similarity(query_embedding, stored_embedding)
-                    similarities.append(similarity)
-                    
-                    document = Document(
-                        page_content=doc_data.get("content", ""),
-                        metadata=doc_data.get("metadata", {})
+            # Score all documents at once and return top k with scores.
+            # Document objects are only built for the returned matches.
+            if docs_data:
+                similarities = cosine_similarities(query_embedding, embedding_matrix)
+                order = top_k_indices(similarities, k)
+                return [
+                    (
+                        Document(
+                            page_content=docs_data[i].get("content", ""),
+                            metadata=docs_data[i].get("metadata", {})
+                        ),
+                        float(similarities[i])
                     )
-                    docs.append(document)
-            
-            # Sort by similarity and return top k with scores
-            if docs:
-                doc_similarities = list(zip(docs, similarities))
-                doc_similarities.sort(key=lambda x: x[1], reverse=True)
-                return doc_similarities[:k]
+                    for i in order
+                ]
             
             return []
         except Exception as e:
             logging.error(f"Failed to perform similarity search with score: {str(e)}")
             return []
     
-    def _cosine_similarity(self, vec1: List[float], vec2: List[float]) -> float:
-        """Calculate cosine similarity between two vectors"""
-        try:
-            vec1_np = np.array(vec1)
-            vec2_np = np.array(vec2)
+    def _get_index(self) -> Tuple[np.ndarray, List[Dict[str, Any]]]:
+        """Return the cached embedding matrix and document data, reloading when stale
+        
+        Avoids streaming the whole collection from Firestore on every query:
+        it is loaded into memory once and reused until it is older than
+        cache_ttl seconds or this store writes to the collection. Writes made
+        through another instance, such as DataLoader.set_db(reset=True), are
+        only seen once the TTL expires. An empty collection is never cached.
+        """
+        if self._index is None or time.monotonic() - self._index_loaded_at > self.cache_ttl:
+            docs_data = []
+            stored_embeddings = []
             
-            dot_product = np.dot(vec1_np, vec2_np)
-            norm1 = np.linalg.norm(vec1_np)
-            norm2 = np.linalg.norm(vec2_np)
+            for doc in self.vector_collection.stream():
+                doc_data = doc.to_dict()
+                embedding = stored_embedding(doc_data)
+                
+                if embedding is not None:
+                    stored_embeddings.append(embedding)
+                    docs_data.append(doc_data)
             
-            if norm1 == 0 or norm2 == 0:
-                return 0.0
+            embedding_matrix = normalize_rows(np.asarray(stored_embeddings, dtype=np.float32))
+            logging.info(f"Loaded {len(docs_data)} embeddings from Firestore collection: {self.collection_name}")
             
-            return dot_product / (norm1 * norm2)
-        except Exception as e:
-            logging.error(f"Failed to calculate cosine similarity: {str(e)}")
-            return 0.0
+            # Keep reloading while empty so documents loaded by another
+            # instance are picked up on the next query
+            if not docs_data:
+                return embedding_matrix, docs_data
+            
+            self._index = (embedding_matrix, docs_data)
+            self._index_loaded_at = time.monotonic()
+        
+        return self._index
     
     def get_document_count(self) -> int:
         """Get the number of documents in the vector collection"""
         try:
-            docs = list(self.vector_collection.stream())
+            # Empty field mask: only document references are transferred
+            docs = list(self.vector_collection.select([]).stream())
             return len(docs)
         except Exception as e:
             logging.error(f"Failed to get vector document count from Firestore: {str(e)}")
@@ -156,22 +221,8 @@ class FirestoreVectorStore:
     def delete_all_vectors(self) -> None:
         """Delete all vectors from the collection"""
         try:
-            batch = self.firestore_loader.db.batch()
-            docs = self.vector_collection.stream()
-            count = 0
-            
-            for doc in docs:
-                batch.delete(doc.reference)
-                count += 1
-                
-                # Firestore batch has a limit of 500 operations
-                if count % 500 == 0:
-                    batch.commit()
-                    batch = self.firestore_loader.db.batch()
-            
-            if count % 500 != 0:
-                batch.commit()
-                
+            count = self.firestore_loader.delete_collection(self.vector_collection)
+            self._index = None
             logging.info(f"Deleted {count} vector documents from Firestore collection: {self.collection_name}")
         except Exception as e:
             logging.error(f"Failed to delete vector documents from Firestore: {str(e)}")
@@ -218,8 +269,6 @@ class FirestoreDataLoader:
         if not FIRESTORE_AVAILABLE:
             raise ImportError("Google Cloud Firestore is not available. Please install google-cloud-firestore.")
         
-        from google.cloud import firestore
-        
         self.project_id = get_env_var("GCP_PROJECT_ID")
         self.database_name = get_env_var("FIRESTORE_DATABASE", "(default)")
         self.collection_name = get_env_var("FIRESTORE_COLLECTION", "documents")
@@ -231,7 +280,6 @@ class FirestoreDataLoader:
         # Initialize Firestore client
         try:
             if self.credentials_path:
-                import os
                 os.environ["GOOGLE_APPLICATION_CREDENTIALS"] = self.credentials_path
             
             # Use named database if specified, otherwise use default
@@ -253,7 +301,6 @@ class FirestoreDataLoader:
     
     def save_documents(self, documents: List[Document]) -> None:
         """Save documents to Firestore"""
-        from google.cloud import firestore
         try:
             batch = self.db.batch()
             
@@ -266,8 +313,14 @@ class FirestoreDataLoader:
                     "timestamp": firestore.SERVER_TIMESTAMP
                 }
                 batch.set(doc_ref, doc_data)
+                
+                # Firestore batch has a limit of 500 operations
+                if (i + 1) % 500 == 0:
+                    batch.commit()
+                    batch = self.db.batch()
             
-            batch.commit()
+            if len(documents) % 500 != 0:
+                batch.commit()
             logging.info(f"Saved {len(documents)} documents to Firestore collection: {self.collection_name}")
         except Exception as e:
             logging.error(f"Failed to save documents to Firestore: {str(e)}")
@@ -291,25 +344,30 @@ class FirestoreDataLoader:
             logging.error(f"Failed to load documents from Firestore: {str(e)}")
             raise
     
+    def delete_collection(self, collection) -> int:
+        """Delete all documents from a collection and return how many were deleted"""
+        batch = self.db.batch()
+        count = 0
+        
+        # Only references are needed for deletion, so skip the document fields
+        for doc in collection.select([]).stream():
+            batch.delete(doc.reference)
+            count += 1
+            
+            # Firestore batch has a limit of 500 operations
+            if count % 500 == 0:
+                batch.commit()
+                batch = self.db.batch()
+        
+        if count % 500 != 0:
+            batch.commit()
+        
+        return count
+    
     def delete_all_documents(self) -> None:
         """Delete all documents from the collection"""
         try:
-            batch = self.db.batch()
-            docs = self.collection.stream()
-            count = 0
-            
-            for doc in docs:
-                batch.delete(doc.reference)
-                count += 1
-                
-                # Firestore batch has a limit of 500 operations
-                if count % 500 == 0:
-                    batch.commit()
-                    batch = self.db.batch()
-            
-            if count % 500 != 0:
-                batch.commit()
-                
+            count = self.delete_collection(self.collection)
             logging.info(f"Deleted {count} documents from Firestore collection: {self.collection_name}")
         except Exception as e:
             logging.error(f"Failed to delete documents from Firestore: {str(e)}")
@@ -318,7 +376,8 @@ class FirestoreDataLoader:
     def get_document_count(self) -> int:
         """Get the number of documents in the collection"""
         try:
-            docs = list(self.collection.stream())
+            # Empty field mask: only document references are transferred
+            docs = list(self.collection.select([]).stream())
             return len(docs)
         except Exception as e:
             logging.error(f"Failed to get document count from Firestore: {str(e)}")
@@ -86,12 +86,14 @@ class HelpDesk():
 
     # Use .stream() for streaming output if available
 
+        # The retrieval step emits its documents once under "context", reuse
+        # them for the sources instead of running the retriever a second time
+        retrieved_docs = []
         for chunk in chain.stream(query):
             chunk = dict(chunk)
+            retrieved_docs.extend(chunk.get("context", []))
             yield chunk.get("answer", "")
 
-
-        retrieved_docs = self.retriever.invoke(question)#.get("context")
         sources_str = self.list_top_k_sources(retrieved_docs, k=2)
         yield sources_str
 
@@ -106,7 +108,7 @@ class HelpDesk():
         
         if sources:
             k = min(k, len(sources))
-            distinct_sources = list(zip(*collections.Counter(sources).most_common()))[0][:k]
+            distinct_sources = [source for source, _ in collections.Counter(sources).most_common(k)]
             distinct_sources_str = "  \n- ".join(distinct_sources)
 
         if len(distinct_sources) == 1:
@@ -18,6 +18,23 @@ except ImportError:
     FIRESTORE_AVAILABLE = False
     logging.warning("Firestore support not available. Install google-cloud-firestore to use Firestore storage.")
 
+# Splitters are stateless, build them once per process instead of per call
+_MD_SPLITTER = MarkdownHeaderTextSplitter(
+    headers_to_split_on=[
+        ("#", "Title 1"),
+        ("##", "Sub-title 1"),
+        ("###", "Sub-title 2"),
+    ]
+)
+
+# Chunk size big enough
+_TEXT_SPLITTER = RecursiveCharacterTextSplitter(
+    chunk_size=512,
+    chunk_overlap=20,
+    separators=["\n\n", "\n", r"(?<=\. )", " ", ""],
+    is_separator_regex=True,
+)
+
 class DataLoader():
     """Create, load, save the DB using the confluence Loader"""
     def __init__(self, storage_type="firestore"):
@@ -66,32 +83,16 @@ class DataLoader():
     
 
     def split_docs(self, docs):
-        # Markdown
-        headers_to_split_on = [
-            ("#", "Title 1"),
-            ("##", "Sub-title 1"),
-            ("###", "Sub-title 2"),
-        ]
-
-        markdown_splitter = MarkdownHeaderTextSplitter(headers_to_split_on=headers_to_split_on)
-
         # Split based on markdown and add original metadata
         md_docs = []
         for doc in docs:
-            md_doc = markdown_splitter.split_text(doc.page_content)
+            md_doc = _MD_SPLITTER.split_text(doc.page_content)
             for i in range(len(md_doc)):
                 md_doc[i].metadata = md_doc[i].metadata | doc.metadata
             md_docs.extend(md_doc)
 
         # RecursiveTextSplitter
-        # Chunk size big enough
-        splitter = RecursiveCharacterTextSplitter(
-            chunk_size=512,
-            chunk_overlap=20,
-            separators=["\n\n", "\n", "(?<=\. )", " ", ""]
-        )
-
-        splitted_docs = splitter.split_documents(md_docs)
+        splitted_docs = _TEXT_SPLITTER.split_documents(md_docs)
         return splitted_docs
 
     def save_to_db(self, splitted_docs):
@@ -13,6 +13,7 @@ from config import set_env, get_env
 #        yield chunk
 
 
+@st.cache_resource
 def get_model(backend_type="firestore"):
     """
     Initialize and cache the model.
@@ -5,9 +5,9 @@ in Vector Search for similarity search functionality.
 """
 import os
 import hashlib
-import base64
 import sys
-from typing import List, Dict, Any
+from concurrent.futures import ThreadPoolExecutor
+from typing import List, Dict, Any, Optional, Tuple
 from google.cloud import storage
 from google.cloud import aiplatform
 from google.cloud import firestore
@@ -16,20 +16,44 @@ import fitz  # PyMuPDF
 
 # Add parent directory to path to import shared utilities
 sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
-from shared_utils import initialize_clients, get_embeddings_model, get_db_client, get_vector_search_config
+from shared_utils import (initialize_clients, get_embeddings_model, get_db_client,
+                          get_index_endpoint, get_vector_search_config, build_vector_id)
 
-def extract_text_from_pdf(pdf_path: str) -> List[Dict[str, Any]]:
-    """Extract text from PDF pages and split into chunks."""
-    text_chunks = []
-    doc = fitz.open(pdf_path)
+# Cloud Storage client, created on first use and reused by warm instances
+gcs_client = None
+
+# Bucket for extracted images. It must not be the upload bucket, whose
+# finalize events trigger this function; images are skipped when unset.
+processing_bucket_name = os.environ.get('PROCESSING_BUCKET')
+
+# Images smaller than this many pixels on either side are skipped
+min_image_dimension = int(os.environ.get('MIN_IMAGE_DIMENSION', '64'))
+
+# Images are downscaled so their longest side is at most this many pixels
+max_image_dimension = int(os.environ.get('MAX_IMAGE_DIMENSION', '1024'))
+
+# Maximum number of concurrent image uploads to Cloud Storage
+image_upload_workers = int(os.environ.get('IMAGE_UPLOAD_WORKERS', '8'))
+
+# Text splitter is stateless, build it once per container instead of per PDF
+text_splitter = RecursiveCharacterTextSplitter(
+    chunk_size=1000,
+    chunk_overlap=200,
+    length_function=len,
+)
+
+def get_storage_client() -> storage.Client:
+    """Get the Cloud Storage client, creating it once per container."""
+    global gcs_client
     
-    # Initialize text splitter
-    text_splitter = RecursiveCharacterTextSplitter(
-        chunk_size=1000,
-        chunk_overlap=200,
-        length_function=len,
-    )
+    if gcs_client is None:
+        gcs_client = storage.Client()
     
+    return gcs_client
+
+def extract_text_from_pdf(doc: fitz.Document) -> List[Dict[str, Any]]:
+    """Extract text from PDF pages and split into chunks."""
+    text_chunks = []
     for page_num in range(len(doc)):
         page = doc.load_page(page_num)
         text = page.get_text()
@@ -50,73 +74,157 @@ def extract_text_from_pdf(pdf_path: str) -> List[Dict[str, Any]]:
                     }
                 })
     
-    doc.close()
     return text_chunks
 
-def extract_images_from_pdf(pdf_path: str) -> List[Dict[str, Any]]:
-    """Extract images from PDF pages."""
-    images = []
-    doc = fitz.open(pdf_path)
+def _encode_image(doc: fitz.Document, xref: int, smask: int,
+                  width: int, height: int) -> Optional[Tuple[bytes, str]]:
+    """Return (image bytes, format) for an embedded image, or None to skip it.
+    
+    JPEG and PNG streams that need no resizing or alpha merge are returned
+    as stored in the PDF, avoiding a decode and re-encode. Everything else is
+    decoded to a pixmap with any soft mask merged as alpha, downscaled if
+    needed and encoded as JPEG, or as PNG when it has an alpha channel.
+    """
+    if not smask and max(width, height) <= max_image_dimension:
+        extracted = doc.extract_image(xref)
+        if extracted['ext'] in ('jpeg', 'png') and extracted['colorspace'] in (1, 3):
+            return extracted['image'], extracted['ext']
+    
+    pix = fitz.Pixmap(doc, xref)
+    if pix.n - pix.alpha >= 4:  # Skip CMYK, only GRAY or RGB are kept
+        return None
     
+    # Merge the soft mask as an alpha channel, otherwise transparent areas
+    # come out black
+    if smask and not pix.alpha:
+        pix = fitz.Pixmap(pix, fitz.Pixmap(doc, smask))
+    
+    # Downscale large images so stored bytes stay bounded
+    longest_side = max(pix.width, pix.height)
+    if longest_side > max_image_dimension:
+        scale = max_image_dimension / longest_side
+        pix = fitz.Pixmap(pix, round(pix.width * scale), round(pix.height * scale))
+    
+    # PNG is only needed to keep transparency, JPEG is much smaller for
+    # photos and scans
+    if pix.alpha:
+        return pix.tobytes("png"), 'png'
+    return pix.tobytes("jpeg", jpg_quality=85), 'jpeg'
+
+def extract_images_from_pdf(doc: fitz.Document) -> List[Dict[str, Any]]:
+    """Extract images from PDF pages.
+    
+    Images are read straight from the in-memory document. An image object
+    shared by several pages (logos, headers) is only encoded and returned the
+    first time its xref is seen.
+    """
+    images = []
+    seen_xrefs = set()
     for page_num in range(len(doc)):
         page = doc.load_page(page_num)
         image_list = page.get_images()
         
         for img_index, img in enumerate(image_list):
             try:
-                xref = img[0]
-                pix = fitz.Pixmap(doc, xref)
+                # get_images() tuples are (xref, smask, width, height, ...)
+                xref, smask, width, height = img[:4]
+                if xref in seen_xrefs:
+                    continue
+                seen_xrefs.add(xref)
+                
+                # Icons, bullets and rule lines are not worth embedding; skip
+                # them before paying for the decode
+                if min(width, height) < min_image_dimension:
+                    continue
+                
+                encoded = _encode_image(doc, xref, smask, width, height)
+                if encoded is None:
+                    continue
+                img_data, img_format = encoded
                 
-                if pix.n - pix.alpha < 4:  # GRAY or RGB
-                    img_data = pix.tobytes("png")
-                    
-                    # Convert image to base64 for storage
-                    img_base64 = base64.b64encode(img_data).decode('utf-8')
-                    
-                    # Create text description for embedding
-                    img_description = f"Image from page {page_num + 1}, position {img_index + 1}"
-                    
-                    images.append({
-                        'content': img_description,  # Text description for embedding
-                        'image_data': img_base64,
-                        'type': 'image',
-                        'page': page_num + 1,
-                        'image_id': f"page_{page_num + 1}_img_{img_index + 1}",
-                        'format': 'png',
-                        'metadata': {
-                            'page_number': page_num + 1,
-                            'image_index': img_index + 1,
-                            'content_type': 'image',
-                            'format': 'png'
-                        }
-                    })
+                # Create text description for embedding
+                img_description = f"Image from page {page_num + 1}, position {img_index + 1}"
                 
-                pix = None
+                images.append({
+                    'content': img_description,  # Text description for embedding
+                    'image_data': img_data,
+                    'type': 'image',
+                    'page': page_num + 1,
+                    'image_id': f"page_{page_num + 1}_img_{img_index + 1}",
+                    'format': img_format,
+                    'metadata': {
+                        'page_number': page_num + 1,
+                        'image_index': img_index + 1,
+                        'content_type': 'image',
+                        'format': img_format
+                    }
+                })
             except Exception as e:
                 print(f"Error extracting image {img_index} from page {page_num + 1}: {e}")
                 continue
     
-    doc.close()
     return images
 
 def create_embeddings(content_items: List[Dict[str, Any]]) -> List[Dict[str, Any]]:
     """Create embeddings for text content using Vertex AI."""
     embeddings_model = get_embeddings_model()
-    texts = [item['content'] for item in content_items]
+    # Repeated chunks (page headers, footers, boilerplate) are embedded once
+    texts = list(dict.fromkeys(item['content'] for item in content_items))
     
     try:
         # Generate embeddings using Vertex AI
-        embeddings = embeddings_model.embed_documents(texts)
+        embeddings = dict(zip(texts, embeddings_model.embed_documents(texts)))
+        hashes = {text: hashlib.md5(str(embedding).encode()).hexdigest()
+                  for text, embedding in embeddings.items()}
         
-        for i, item in enumerate(content_items):
-            item['embedding'] = embeddings[i]
-            item['embedding_hash'] = hashlib.md5(str(embeddings[i]).encode()).hexdigest()
+        for item in content_items:
+            item['embedding'] = embeddings[item['content']]
+            item['embedding_hash'] = hashes[item['content']]
         
         return content_items
     except Exception as e:
         print(f"Error creating embeddings: {e}")
         raise
 
+def store_images_in_gcs(storage_client: storage.Client, bucket_name: str,
+                        document_id: str, images: List[Dict[str, Any]]):
+    """Upload extracted image bytes to Cloud Storage and record their URI.
+    
+    Keeps the image payload out of Firestore so chunk documents stay small
+    and well under the 1 MiB per-document limit.
+    """
+    bucket = storage_client.bucket(bucket_name)
+    
+    def upload(image: Dict[str, Any]):
+        blob_name = f"images/{document_id}/{image['image_id']}.{image['format']}"
+        bucket.blob(blob_name).upload_from_string(
+            image.pop('image_data'), content_type=f"image/{image['format']}"
+        )
+        image['image_uri'] = f"gs://{bucket_name}/{blob_name}"
+    
+    # Uploads are independent network calls, run them concurrently
+    with ThreadPoolExecutor(max_workers=min(len(images), image_upload_workers) or 1) as executor:
+        list(executor.map(upload, images))
+
+def _commit_in_batches(db_client: firestore.Client, writes: List[Tuple[Any, Dict[str, Any]]]):
+    """Set (document reference, data) pairs using as few write batches as possible.
+    
+    Each batch commit raises on failure, so a write that cannot be stored
+    fails the invocation instead of being dropped.
+    """
+    batch = db_client.batch()
+    
+    for count, (ref, data) in enumerate(writes, start=1):
+        batch.set(ref, data)
+        
+        # Firestore batch has a limit of 500 operations
+        if count % 500 == 0:
+            batch.commit()
+            batch = db_client.batch()
+    
+    if len(writes) % 500 != 0:
+        batch.commit()
+
 def store_in_firestore(document_id: str, text_chunks: List[Dict[str, Any]], 
                       images: List[Dict[str, Any]], metadata: Dict[str, Any]):
     """Store document metadata and content in Firestore."""
@@ -135,10 +243,12 @@ def store_in_firestore(document_id: str, text_chunks: List[Dict[str, Any]],
         'processing_metadata': metadata
     })
     
-    # Store text chunks
+    # Store text chunks and images in write batches instead of one RPC each
+    writes = []
+    
     for chunk in text_chunks:
         chunk_ref = db_client.collection('document_chunks').document()
-        chunk_ref.set({
+        writes.append((chunk_ref, {
             'document_id': document_id,
             'content': chunk['content'],
             'embedding_hash': chunk['embedding_hash'],
@@ -147,22 +257,23 @@ def store_in_firestore(document_id: str, text_chunks: List[Dict[str, Any]],
             'type': chunk['type'],
             'metadata': chunk['metadata'],
             'created_at': firestore.SERVER_TIMESTAMP
-        })
+        }))
     
-    # Store images
     for image in images:
         img_ref = db_client.collection('document_chunks').document()
-        img_ref.set({
+        writes.append((img_ref, {
             'document_id': document_id,
             'content': image['content'],
-            'image_data': image['image_data'],
+            'image_uri': image['image_uri'],
             'embedding_hash': image['embedding_hash'],
             'page': image['page'],
             'image_id': image['image_id'],
             'type': image['type'],
             'metadata': image['metadata'],
             'created_at': firestore.SERVER_TIMESTAMP
-        })
+        }))
+    
+    _commit_in_batches(db_client, writes)
 
 def store_in_vector_search(content_items: List[Dict[str, Any]], document_id: str):
     """Store embeddings in Vertex AI Vector Search."""
@@ -173,16 +284,17 @@ def store_in_vector_search(content_items: List[Dict[str, Any]], document_id: str
         print("Vector Search endpoint or index not configured, skipping vector storage")
         return
     
+    if not content_items:
+        return
+    
     try:
         # Get the Vector Search index
-        index_endpoint = aiplatform.MatchingEngineIndexEndpoint(
-            index_endpoint_name=config['endpoint_id']
-        )
+        index_endpoint = get_index_endpoint()
         
         # Prepare data for Vector Search
         datapoints = []
         for item in content_items:
-            vector_id = f"{document_id}_{item.get('chunk_id', item.get('image_id', 'unknown'))}"
+            vector_id = build_vector_id(document_id, item)
             
             # Create datapoint for Vector Search
             datapoint = aiplatform.MatchingEngineIndexEndpoint.Datapoint(
@@ -202,28 +314,32 @@ def store_in_vector_search(content_items: List[Dict[str, Any]], document_id: str
             datapoints.append(datapoint)
         
         # Upsert vectors to the index
-        if datapoints:
-            response = index_endpoint.upsert_datapoints(
-                deployed_index_id=config['index_id'],
-                datapoints=datapoints
-            )
-            print(f"Successfully stored {len(datapoints)} vectors in Vector Search")
-            
-            # Also store metadata in Firestore for reference
-            for i, item in enumerate(content_items):
-                vector_id = f"{document_id}_{item.get('chunk_id', item.get('image_id', 'unknown'))}"
-                vector_ref = db_client.collection('vector_metadata').document(vector_id)
-                vector_ref.set({
-                    'document_id': document_id,
-                    'content': item['content'][:500],  # Truncate for storage
-                    'type': item['type'],
-                    'page': item['page'],
-                    'metadata': item.get('metadata', {}),
-                    'created_at': firestore.SERVER_TIMESTAMP
-                })
+        index_endpoint.upsert_datapoints(
+            deployed_index_id=config['index_id'],
+            datapoints=datapoints
+        )
+        print(f"Successfully stored {len(datapoints)} vectors in Vector Search")
         
     except Exception as e:
         print(f"Error storing in Vector Search: {e}")
+        return
+    
+    # Also store metadata in Firestore for reference. This is outside the
+    # try block so a failed write fails the invocation: search drops any
+    # neighbor whose metadata is missing.
+    writes = []
+    for item in content_items:
+        vector_id = build_vector_id(document_id, item)
+        vector_ref = db_client.collection('vector_metadata').document(vector_id)
+        writes.append((vector_ref, {
+            'document_id': document_id,
+            'content': item['content'][:500],  # Truncate for storage
+            'type': item['type'],
+            'page': item['page'],
+            'metadata': item.get('metadata', {}),
+            'created_at': firestore.SERVER_TIMESTAMP
+        }))
+    _commit_in_batches(db_client, writes)
 
 def process_document(event, context):
     """
@@ -237,7 +353,7 @@ def process_document(event, context):
     """
     bucket_name = event['bucket']
     file_name = event['name']
-    temp_file_path = None
+    doc = None
     
     # Only process PDF files
     if not file_name.lower().endswith('.pdf'):
@@ -250,38 +366,60 @@ def process_document(event, context):
         # Initialize clients
         initialize_clients()
         
-        # Initialize GCS client
-        storage_client = storage.Client()
+        # Get GCS client
+        storage_client = get_storage_client()
         bucket = storage_client.bucket(bucket_name)
         blob = bucket.blob(file_name)
         
-        # Download file content
-        temp_file_path = f"/tmp/{os.path.basename(file_name)}"
-        blob.download_to_filename(temp_file_path)
-        print(f"Downloaded PDF to {temp_file_path}")
+        # Download file content and open it once in memory for both
+        # text and image extraction
+        pdf_bytes = blob.download_as_bytes()
+        doc = fitz.open(stream=pdf_bytes, filetype="pdf")
+        print(f"Downloaded PDF with {doc.page_count} pages")
         
         # Generate document ID
         document_id = hashlib.md5(f"{bucket_name}/{file_name}".encode()).hexdigest()
         
-        # Extract text and images
+        # Extract text and images. PyMuPDF is not thread-safe, so extraction
+        # stays on this thread while the embedding and upload RPCs for
+        # already-extracted content run in the background.
         print("Extracting text from PDF...")
-        text_chunks = extract_text_from_pdf(temp_file_path)
+        text_chunks = extract_text_from_pdf(doc)
         print(f"Extracted {len(text_chunks)} text chunks")
         
-        print("Extracting images from PDF...")
-        images = extract_images_from_pdf(temp_file_path)
-        print(f"Extracted {len(images)} images")
+        with ThreadPoolExecutor(max_workers=2) as executor:
+            text_future = None
+            if text_chunks:
+                print("Creating text embeddings...")
+                text_future = executor.submit(create_embeddings, text_chunks)
+            
+            if not processing_bucket_name:
+                print("PROCESSING_BUCKET not set, skipping image extraction")
+                images = []
+            else:
+                print("Extracting images from PDF...")
+                images = extract_images_from_pdf(doc)
+                print(f"Extracted {len(images)} images")
+            
+            if images:
+                print("Uploading images to Cloud Storage...")
+                upload_future = executor.submit(
+                    store_images_in_gcs, storage_client,
+                    processing_bucket_name, document_id, images
+                )
+                print("Creating image embeddings...")
+                create_embeddings(images)
+                upload_future.result()
+            
+            if text_future is not None:
+                text_future.result()
         
-        # Combine all content for embedding
+        # Combine all content for storage
         all_content = text_chunks + images
         
         if all_content:
-            # Create embeddings
-            print("Creating embeddings...")
-            all_content = create_embeddings(all_content)
-            
             # Store in Firestore
-            print("Storing in Firestore...")
+            print("Storing in Firestore and Vector Search...")
             metadata = {
                 'filename': os.path.basename(file_name),
                 'bucket': bucket_name,
@@ -289,11 +427,15 @@ def process_document(event, context):
                 'file_size': blob.size,
                 'content_type': blob.content_type
             }
-            store_in_firestore(document_id, text_chunks, images, metadata)
-            
-            # Store in Vector Search
-            print("Storing in Vector Search...")
-            store_in_vector_search(all_content, document_id)
+            # Firestore and Vector Search writes are independent, run them
+            # concurrently so ingest latency is the slower of the two
+            with ThreadPoolExecutor(max_workers=2) as executor:
+                firestore_future = executor.submit(
+                    store_in_firestore, document_id, text_chunks, images, metadata
+                )
+                vector_future = executor.submit(store_in_vector_search, all_content, document_id)
+                firestore_future.result()
+                vector_future.result()
             
             print(f"Successfully processed {file_name}")
         else:
@@ -304,7 +446,5 @@ def process_document(event, context):
         raise
     
     finally:
-        # Clean up temp file
-        if temp_file_path and os.path.exists(temp_file_path):
-            os.remove(temp_file_path)
-            print(f"Removed temp file {temp_file_path}")
+        if doc is not None:
+            doc.close()
@@ -4,43 +4,129 @@ Performs semantic similarity search on stored PDF embeddings.
 """
 import os
 import sys
+import logging
+from array import array
+from functools import lru_cache
 from typing import List, Dict, Any, Optional
+from google.api_core.exceptions import GoogleAPIError
 from google.cloud import aiplatform
 
 # Add parent directory to path to import shared utilities
 sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
-from shared_utils import initialize_clients, get_embeddings_model, get_db_client, get_vector_search_config
+from shared_utils import (initialize_clients, get_embeddings_model, get_db_client,
+                          get_index_endpoint, get_vector_search_config, build_vector_id)
 
-def similarity_search(query: str, top_k: int = 5, content_type: Optional[str] = None) -> List[Dict[str, Any]]:
-    """Perform similarity search on stored embeddings."""
+# Nothing else configures logging in the function runtime, so INFO records
+# would otherwise be dropped instead of reaching Cloud Logging
+logging.basicConfig(level=logging.INFO)
+logger = logging.getLogger(__name__)
+
+# Fields of a vector_metadata document that end up in a search result;
+# used as a field mask so hydration never transfers anything else
+RESULT_FIELDS = ('document_id', 'content', 'type', 'page', 'metadata')
+
+@lru_cache(maxsize=256)
+def embed_query(query: str) -> array:
+    """Create an embedding for a search query, cached per warm instance.
+    
+    Repeated queries skip the Vertex AI embedding call entirely. Embeddings
+    are kept as float32 arrays, about 3 KB each for 768 dimensions instead
+    of about 25 KB as Python floats.
+    """
+    return array('f', get_embeddings_model().embed_query(query))
+
+def build_restricts(content_type: Optional[str] = None,
+                    exclude_document_id: Optional[str] = None) -> List[Any]:
+    """Build the Vector Search restricts for the content type and document filters."""
+    restricts = []
+    if content_type:
+        restricts.append(
+            aiplatform.MatchingEngineIndexEndpoint.FindNeighborsRequest.Query.Restriction(
+                namespace="content_type",
+                allow_list=[content_type]
+            )
+        )
+    if exclude_document_id:
+        restricts.append(
+            aiplatform.MatchingEngineIndexEndpoint.FindNeighborsRequest.Query.Restriction(
+                namespace="document_id",
+                deny_list=[exclude_document_id]
+            )
+        )
+    return restricts
+
+def vector_search_configured() -> bool:
+    """Check that the Vector Search endpoint and index are configured.
+    
+    Callers check this before any embedding work, so an unconfigured
+    deployment never pays for a Vertex AI call it cannot use.
+    """
+    config = get_vector_search_config()
+    if not config['endpoint_id'] or not config['index_id']:
+        logger.warning("Vector Search not configured, returning empty results")
+        return False
+    return True
+
+def fetch_stored_embedding(vector_id: str) -> Optional[List[float]]:
+    """Read the embedding already stored in Vector Search for a datapoint.
+    
+    Returns None when the datapoint cannot be read, so callers can fall
+    back to embedding the content.
+    """
+    config = get_vector_search_config()
+    
+    try:
+        datapoints = get_index_endpoint().read_index_datapoints(
+            deployed_index_id=config['index_id'],
+            ids=[vector_id]
+        )
+    except (GoogleAPIError, ValueError):
+        logger.exception("Failed to read stored embedding for %s", vector_id)
+        return None
+    
+    if not datapoints or not datapoints[0].feature_vector:
+        return None
+    return list(datapoints[0].feature_vector)
+
+def similarity_search(query: str, top_k: int = 5, content_type: Optional[str] = None,
+                      exclude_document_id: Optional[str] = None) -> List[Dict[str, Any]]:
+    """Perform similarity search on stored embeddings for a text query."""
+    if not vector_search_configured():
+        return []
+    
+    try:
+        # Create embedding for the query
+        query_embedding = list(embed_query(query))
+    except (GoogleAPIError, ValueError):
+        logger.exception("Query embedding failed")
+        return []
+    
+    results = similarity_search_by_vector(query_embedding, top_k, content_type,
+                                          exclude_document_id)
+    logger.info("Found %d similar items for query: '%s'", len(results), query)
+    return results
+
+def similarity_search_by_vector(query_embedding: List[float], top_k: int = 5,
+                                content_type: Optional[str] = None,
+                                exclude_document_id: Optional[str] = None) -> List[Dict[str, Any]]:
+    """Perform similarity search on stored embeddings for an embedding vector.
+    
+    Filters are pushed down into the Vector Search query as namespace
+    restricts, so excluded documents never take up one of the top_k slots.
+    """
+    if not vector_search_configured():
+        return []
+    
     try:
-        embeddings_model = get_embeddings_model()
         db_client = get_db_client()
         config = get_vector_search_config()
         
-        # Create embedding for the query
-        query_embedding = embeddings_model.embed_query(query)
-        
-        if not config['endpoint_id'] or not config['index_id']:
-            print("Vector Search not configured, returning empty results")
-            return []
-        
         # Get the Vector Search index endpoint
-        index_endpoint = aiplatform.MatchingEngineIndexEndpoint(
-            index_endpoint_name=config['endpoint_id']
-        )
-        
-        # Prepare restricts for filtering
-        restricts = []
-        if content_type:
-            restricts.append(
-                aiplatform.MatchingEngineIndexEndpoint.FindNeighborsRequest.Query.Restriction(
-                    namespace="content_type",
-                    allow_list=[content_type]
-                )
-            )
+        index_endpoint = get_index_endpoint()
         
         # Create query
+        restricts = build_restricts(content_type, exclude_document_id)
+        
         query_obj = aiplatform.MatchingEngineIndexEndpoint.FindNeighborsRequest.Query(
             feature_vector=query_embedding,
             neighbor_count=top_k,
@@ -56,16 +142,24 @@ def similarity_search(query: str, top_k: int = 5, content_type: Optional[str] =
         # Process results
         results = []
         if response.nearest_neighbors:
-            for neighbor in response.nearest_neighbors[0].neighbors:
+            neighbors = response.nearest_neighbors[0].neighbors
+            
+            # Fetch metadata for all neighbors in one batched Firestore read
+            vector_ids = list(dict.fromkeys(n.datapoint.datapoint_id for n in neighbors))
+            vector_refs = [db_client.collection('vector_metadata').document(vector_id)
+                           for vector_id in vector_ids]
+            metadata_by_id = {
+                snapshot.id: snapshot.to_dict()
+                for snapshot in db_client.get_all(vector_refs, field_paths=RESULT_FIELDS)
+                if snapshot.exists
+            }
+            
+            for neighbor in neighbors:
                 vector_id = neighbor.datapoint.datapoint_id
                 similarity_score = neighbor.distance
+                metadata = metadata_by_id.get(vector_id)
                 
-                # Get metadata from Firestore
-                vector_ref = db_client.collection('vector_metadata').document(vector_id)
-                vector_doc = vector_ref.get()
-                
-                if vector_doc.exists:
-                    metadata = vector_doc.to_dict()
+                if metadata is not None:
                     results.append({
                         'vector_id': vector_id,
                         'similarity_score': similarity_score,
@@ -76,11 +170,12 @@ def similarity_search(query: str, top_k: int = 5, content_type: Optional[str] =
                         'metadata': metadata.get('metadata', {})
                     })
         
-        print(f"Found {len(results)} similar items for query: '{query}'")
         return results
         
-    except Exception as e:
-        print(f"Error in similarity search: {e}")
+    except (GoogleAPIError, ValueError):
+        # Transient Vertex AI / Firestore failures degrade to no results,
+        # anything unexpected propagates to the HTTP handler as a 500
+        logger.exception("Similarity search failed")
         return []
 
 def search_similar_documents(request):
@@ -94,13 +189,14 @@ def search_similar_documents(request):
         JSON response with similar documents
     """
     try:
-        initialize_clients()
-        
-        # Parse request
+        # Parse request before initializing clients so malformed requests
+        # are rejected without paying for client setup
         request_json = request.get_json(silent=True)
         if not request_json or 'query' not in request_json:
             return {'error': 'Query parameter required'}, 400
         
+        initialize_clients()
+        
         query = request_json['query']
         top_k = request_json.get('top_k', 5)
         content_type = request_json.get('content_type', None)
@@ -129,13 +225,14 @@ def search_by_document(request):
         JSON response with similar documents
     """
     try:
-        initialize_clients()
-        
-        # Parse request
+        # Parse request before initializing clients so malformed requests
+        # are rejected without paying for client setup
         request_json = request.get_json(silent=True)
         if not request_json or 'document_id' not in request_json:
             return {'error': 'Document ID parameter required'}, 400
         
+        initialize_clients()
+        
         document_id = request_json['document_id']
         top_k = request_json.get('top_k', 5)
         content_type = request_json.get('content_type', None)
@@ -144,7 +241,7 @@ def search_by_document(request):
         
         # Get document chunks to use as query
         chunks_ref = db_client.collection('document_chunks').where('document_id', '==', document_id)
-        chunks = chunks_ref.limit(1).stream()
+        chunks = chunks_ref.select(['content', 'chunk_id', 'image_id']).limit(1).stream()
         
         # Use the first chunk as the query
         query_text = None
@@ -156,17 +253,25 @@ def search_by_document(request):
         if not query_text:
             return {'error': 'Document not found or has no content'}, 404
         
-        # Perform similarity search
-        results = similarity_search(query_text, top_k, content_type)
-        
-        # Filter out the source document from results
-        filtered_results = [r for r in results if r['document_id'] != document_id]
+        results = []
+        if vector_search_configured():
+            # Reuse the chunk's embedding from the index instead of re-embedding
+            # its content, falling back to a fresh embedding if it can't be read
+            query_embedding = fetch_stored_embedding(build_vector_id(document_id, chunk_data))
+            if query_embedding is None:
+                # Embed as a document, the way ingestion created the stored
+                # datapoint, so both paths search from the same embedding space
+                query_embedding = get_embeddings_model().embed_documents([query_text])[0]
+            
+            # Perform similarity search, excluding the source document in the index
+            results = similarity_search_by_vector(query_embedding, top_k, content_type,
+                                                  exclude_document_id=document_id)
         
         return {
             'source_document_id': document_id,
             'query_text': query_text[:200] + '...' if len(query_text) > 200 else query_text,
-            'results': filtered_results,
-            'count': len(filtered_results),
+            'results': results,
+            'count': len(results),
             'content_type_filter': content_type
         }
         
@@ -3,6 +3,7 @@ Shared utilities for PDF processing and search functions.
 Contains common initialization and helper functions.
 """
 import os
+from typing import Any, Dict
 from google.cloud import aiplatform
 from google.cloud import firestore
 from langchain_google_vertexai import VertexAIEmbeddings
@@ -10,6 +11,7 @@ from langchain_google_vertexai import VertexAIEmbeddings
 # Global variables for model initialization
 embeddings_model = None
 db_client = None
+index_endpoint = None
 project_id = os.environ.get('GCP_PROJECT', 'your-project-id')
 location = os.environ.get('LOCATION', 'us-central1')
 vector_search_endpoint_id = os.environ.get('VECTOR_SEARCH_ENDPOINT_ID')
@@ -39,6 +41,22 @@ def get_db_client():
     """Get the initialized Firestore client."""
     return db_client
 
+def get_index_endpoint():
+    """Get the Vector Search index endpoint, constructing it once per container.
+    
+    Building a MatchingEngineIndexEndpoint issues a GetIndexEndpoint RPC and
+    sets up new gRPC channels, so it is cached alongside the other clients.
+    Returns None when no endpoint is configured.
+    """
+    global index_endpoint
+    
+    if index_endpoint is None and vector_search_endpoint_id:
+        index_endpoint = aiplatform.MatchingEngineIndexEndpoint(
+            index_endpoint_name=vector_search_endpoint_id
+        )
+    
+    return index_endpoint
+
 def get_vector_search_config():
     """Get vector search configuration."""
     return {
@@ -47,3 +65,7 @@ def get_vector_search_config():
         'project_id': project_id,
         'location': location
     }
+
+def build_vector_id(document_id: str, item: Dict[str, Any]) -> str:
+    """Build the Vector Search datapoint ID for a text chunk or image."""
+    return f"{document_id}_{item.get('chunk_id', item.get('image_id', 'unknown'))}"
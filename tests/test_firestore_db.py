@@ -0,0 +1,196 @@
+"""
+Tests for the Firestore vector store's embedding storage and scoring helpers.
+"""
+import os
+import sys
+from types import SimpleNamespace
+import numpy as np
+import pytest
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))),
+                                "src", "document-management-ui"))
+import firestore_db
+from firestore_db import (FirestoreVectorStore, quantize_embedding, dequantize_embedding,
+                          stored_embedding, top_k_indices, normalize_rows)
+
+class FakeSnapshot:
+    """Minimal stand-in for a Firestore document snapshot."""
+
+    def __init__(self, data):
+        self._data = data
+
+    def to_dict(self):
+        return dict(self._data)
+
+class FakeCollection:
+    """In-memory Firestore collection keyed by document ID."""
+
+    def __init__(self):
+        self.docs = {}
+
+    def document(self, doc_id):
+        return SimpleNamespace(collection=self, id=doc_id)
+
+    def select(self, field_paths):
+        return self
+
+    def stream(self):
+        return [FakeSnapshot(data) for data in self.docs.values()]
+
+class FakeBatch:
+    """Write batch that applies its writes to the collection on commit."""
+
+    def __init__(self, db):
+        self.db = db
+        self.writes = []
+
+    def set(self, ref, data):
+        self.writes.append((ref, data))
+
+    def commit(self):
+        assert len(self.writes) <= 500
+        for ref, data in self.writes:
+            ref.collection.docs[ref.id] = data
+        self.db.commits.append(len(self.writes))
+
+class FakeDB:
+    """Firestore client that records the size of each batch commit."""
+
+    def __init__(self):
+        self.collections = {}
+        self.commits = []
+
+    def collection(self, name):
+        return self.collections.setdefault(name, FakeCollection())
+
+    def batch(self):
+        return FakeBatch(self)
+
+class FakeEmbeddings:
+    """Embeddings that look texts up in a fixed table and record calls."""
+
+    def __init__(self, vectors):
+        self.vectors = vectors
+        self.document_calls = []
+
+    def embed_documents(self, texts):
+        self.document_calls.append(list(texts))
+        return [self.vectors[text] for text in texts]
+
+    def embed_query(self, text):
+        return self.vectors[text]
+
+@pytest.fixture
+def make_store(monkeypatch):
+    """Fixture for building a vector store over a fake Firestore client."""
+    monkeypatch.setattr(firestore_db, "firestore",
+                        SimpleNamespace(SERVER_TIMESTAMP="server-timestamp"), raising=False)
+
+    def make(vectors):
+        loader = SimpleNamespace(collection_name="documents", db=FakeDB())
+        return FirestoreVectorStore(loader, FakeEmbeddings(vectors))
+
+    return make
+
+def test_quantize_round_trip():
+    """Test that dequantizing restores the embedding within one int8 step."""
+    embedding = [0.5, -1.27, 0.0, 0.003, 1.0]
+    data, scale = quantize_embedding(embedding)
+
+    assert isinstance(data, bytes)
+    assert len(data) == len(embedding)
+
+    restored = dequantize_embedding(data, scale)
+    assert restored.dtype == np.float32
+    np.testing.assert_allclose(restored, embedding, atol=scale / 2 + 1e-6)
+
+def test_quantize_zero_vector():
+    """Test that a zero vector uses a scale of 1.0 instead of dividing by zero."""
+    data, scale = quantize_embedding([0.0, 0.0, 0.0])
+
+    assert scale == 1.0
+    np.testing.assert_array_equal(dequantize_embedding(data, scale), [0.0, 0.0, 0.0])
+
+def test_stored_embedding_quantized():
+    """Test reading an embedding stored as int8 bytes and scale."""
+    data, scale = quantize_embedding([0.25, -0.5, 1.0])
+
+    embedding = stored_embedding({"embedding_i8": data, "embedding_scale": scale})
+
+    np.testing.assert_allclose(embedding, [0.25, -0.5, 1.0], atol=scale / 2 + 1e-6)
+
+def test_stored_embedding_legacy():
+    """Test reading an embedding stored as a plain float array."""
+    embedding = stored_embedding({"embedding": [0.25, -0.5, 1.0]})
+
+    assert embedding.dtype == np.float32
+    np.testing.assert_array_equal(embedding, np.float32([0.25, -0.5, 1.0]))
+
+def test_stored_embedding_missing():
+    """Test that documents without an embedding are skipped."""
+    assert stored_embedding({"content": "no embedding"}) is None
+
+def test_top_k_indices():
+    """Test that the k highest scores are returned best first."""
+    scores = np.array([0.1, 0.9, 0.3, 0.7, 0.5])
+
+    np.testing.assert_array_equal(top_k_indices(scores, 3), [1, 3, 4])
+    np.testing.assert_array_equal(top_k_indices(scores, 10), [1, 3, 4, 2, 0])
+    assert len(top_k_indices(scores, 0)) == 0
+
+def test_normalize_rows():
+    """Test that rows are scaled to unit length and zero rows stay zero."""
+    matrix = np.array([[3.0, 4.0], [0.0, 0.0]], dtype=np.float32)
+
+    normalized = normalize_rows(matrix)
+
+    np.testing.assert_allclose(normalized, [[0.6, 0.8], [0.0, 0.0]])
+    assert normalize_rows(np.empty((0, 2), dtype=np.float32)).shape == (0, 2)
+
+def test_add_documents_batches_and_dedupes(make_store):
+    """Test that writes are committed in batches of 500 and each text is embedded once."""
+    store = make_store({"header": [1.0, 0.0], "body": [0.0, 1.0]})
+    documents = [
+        firestore_db.Document(page_content="header" if i % 2 else "body", metadata={"i": i})
+        for i in range(1001)
+    ]
+
+    store.add_documents(documents)
+
+    assert store.firestore_loader.db.commits == [500, 500, 1]
+    assert store.embeddings.document_calls == [["body", "header"]]
+
+    saved = store.vector_collection.docs.values()
+    assert len(saved) == 1001
+    assert all("embedding_i8" in data and "embedding" not in data for data in saved)
+
+def test_similarity_search_with_score_over_quantized_documents(make_store):
+    """Test ordering and scores of a search over int8-stored embeddings."""
+    store = make_store({
+        "north": [0.0, 1.0],
+        "north east": [0.6, 0.8],
+        "east": [1.0, 0.0],
+        "query": [0.0, 2.0],
+    })
+    store.add_documents([
+        firestore_db.Document(page_content=text, metadata={"name": text})
+        for text in ("east", "north east", "north")
+    ])
+
+    results = store.similarity_search_with_score("query", k=2)
+
+    assert [doc.page_content for doc, _ in results] == ["north", "north east"]
+    assert [doc.metadata for doc, _ in results] == [{"name": "north"}, {"name": "north east"}]
+    np.testing.assert_allclose([score for _, score in results], [1.0, 0.8], atol=1e-2)
+
+def test_empty_index_is_not_cached(make_store):
+    """Test that documents written by another store are found after an empty search."""
+    vectors = {"east": [1.0, 0.0], "query": [1.0, 0.0]}
+    store = make_store(vectors)
+    writer = FirestoreVectorStore(store.firestore_loader, FakeEmbeddings(vectors))
+
+    assert store.similarity_search("query") == []
+
+    writer.add_documents([firestore_db.Document(page_content="east")])
+
+    assert [doc.page_content for doc in store.similarity_search("query")] == ["east"]